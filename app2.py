@@ -1,12 +1,15 @@
 #app2.py
 import streamlit as st
-from pbixray.core import PBIXRay
 import os
-import tempfile
 from io import BytesIO
 import pandas as pd
 import traceback 
-import xlsxwriter 
+import hashlib
+import datetime
+import decimal
+import math
+import logging
+import pyarrow as pa
 
 st.set_page_config(
 layout="wide", 
@@ -14,132 +17,247 @@ page_title="PBIX Analyzer Advanced",
 page_icon="📊" 
 )
 
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+logger = logging.getLogger(__name__)
+if os.environ.get("PBIX_DEBUG"):
+    logging.basicConfig()
+    logger.setLevel(logging.DEBUG)
+
+
+def snapshot_report_data(pbix_ray):
+    """Reads every report property from a PBIXRay instance into a plain dict."""
+    # Extract various pieces of information using pbixray
+    return {
+        "metadata": pbix_ray.metadata,
+        "schema": pbix_ray.schema,
+        "relationships": pbix_ray.relationships,
+        "power_query": pbix_ray.power_query,
+        "m_parameters": pbix_ray.m_parameters,
+        "dax_tables": pbix_ray.dax_tables,
+        "dax_measures": pbix_ray.dax_measures,
+        #"model": pbix_ray.model,
+    }
+
+
+def fingerprint_upload(uploaded_file):
+    """Returns a cache key built from the size and the first and last MiB of the upload."""
+    # A pbix is a ZIP archive whose trailing central directory holds the CRC-32 of every
+    # member, so the tail changes whenever any part of the content does
+    with uploaded_file.getbuffer() as buffer:
+        digest = hashlib.blake2b(len(buffer).to_bytes(8, "big"), digest_size=16)
+        digest.update(buffer[:1 << 20])
+        digest.update(buffer[-(1 << 20):])
+    return digest.hexdigest()
+
+
+# Parse the pbix once per uploaded file; reruns are served from the cache
+@st.cache_resource(show_spinner="Parsing PBIX…", max_entries=8)
+def load_pbix(file_hash: str, _uploaded_file) -> dict:
+    """Parses the uploaded pbix with PBIXRay and snapshots the extracted report data."""
+    # Imported on first use so the server's first page load, before any upload, skips importing pbixray
+    from pbixray.core import PBIXRay
+
+    # A pbix is a ZIP container and pbixray reads file objects directly, so parse the
+    # in-memory upload without writing it to disk first
+    _uploaded_file.seek(0)
+    return snapshot_report_data(PBIXRay(_uploaded_file))
+
+
+# Arrow tables are what st.dataframe ships to the browser; convert once per file
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_arrow_tables(file_hash: str, _report_data: dict) -> dict:
+    """Converts the DataFrames in the report data to Arrow tables for display."""
+    arrow_tables = {}
+    for key, value in _report_data.items():
+        if isinstance(value, pd.DataFrame):
+            try:
+                value = pa.Table.from_pandas(value, preserve_index=False)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Mixed-type object columns; let Streamlit apply its own fallback conversion
+                pass
+        arrow_tables[key] = value
+    return arrow_tables
+
+
+class SheetNameTable(dict):
+    """str.translate table that keeps alphanumerics, spaces and underscores and drops the rest."""
+
+    def __missing__(self, code_point):
+        char = chr(code_point)
+        self[code_point] = code_point if char.isalnum() or char in (' ', '_') else None
+        return self[code_point]
+
+
+_SHEET_NAME_TABLE = SheetNameTable()
+
+
+def excel_cell(value, formats):
+    """Converts a value to what xlsxwriter should write and its cell format, as pandas' to_excel does."""
+    if pd.api.types.is_scalar(value) and pd.isna(value):
+        return None, None
+    if pd.api.types.is_integer(value):
+        return int(value), None
+    if pd.api.types.is_float(value):
+        if math.isinf(value):
+            return ("inf" if value > 0 else "-inf"), None
+        return float(value), None
+    if pd.api.types.is_bool(value):
+        return bool(value), None
+    if isinstance(value, decimal.Decimal):
+        return value, None
+    # datetime is a subclass of date, so it has to be checked first
+    if isinstance(value, datetime.datetime):
+        return value, formats["datetime"]
+    if isinstance(value, datetime.date):
+        return value, formats["date"]
+    if isinstance(value, datetime.timedelta):
+        # Durations are written as fractional days
+        return value.total_seconds() / 86400, formats["duration"]
+    # Everything else, datetime.time included, is written as text
+    return str(value), None
+
+
+def write_records(writer, sheet_name, headers, rows, formats):
+    """Writes a header row and the value rows straight to a new xlsxwriter worksheet."""
+    worksheet = writer.book.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, headers, formats["header"])
+    for row_number, row in enumerate(rows, start=1):
+        for column_number, value in enumerate(row):
+            worksheet.write(row_number, column_number, *excel_cell(value, formats))
+
+
 # Function to generate Excel document
 def generate_excel_doc(report_data):
     """Generates an Excel document with multiple sheets from the extracted report data."""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        for key, value in report_data.items():
+    # DAX and M expressions are plain text; skip xlsxwriter's per-string URL detection.
+    # in_memory keeps xlsxwriter from staging every XML part in a temp file, even for a BytesIO target.
+    # constant_memory is not set: xlsxwriter ignores it whenever in_memory is on
+    writer_options = {'strings_to_urls': False, 'in_memory': True}
+    with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': writer_options}) as writer:
+        # Number formats match pandas' to_excel defaults and the header style its pre-3.0 default;
+        # without a number format xlsxwriter writes dates as bare serial numbers
+        formats = {
+            "header": writer.book.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}),
+            "datetime": writer.book.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'}),
+            "date": writer.book.add_format({'num_format': 'YYYY-MM-DD'}),
+            "duration": writer.book.add_format({'num_format': '0'}),
+        }
+
+        for sheet_number, (key, value) in enumerate(report_data.items(), start=1):
+            # Ensure sheet name is valid (max 31 chars, no invalid characters)
+            sheet_name = key[:31].translate(_SHEET_NAME_TABLE).rstrip()
+            if not sheet_name:
+                sheet_name = f"Sheet{sheet_number}" # Fallback name
+
             # Attempt to convert various data types to DataFrame for Excel
             if isinstance(value, pd.DataFrame):
                 df = value
             elif isinstance(value, list):
-                # Try to create a DataFrame from a list of dictionaries
+                if value and all(isinstance(item, dict) for item in value):
+                    # A list of dictionaries is already row-shaped; write it without a DataFrame round-trip
+                    headers = list(dict.fromkeys(column for item in value for column in item))
+                    if headers:
+                        rows = ([item.get(column) for column in headers] for item in value)
+                        write_records(writer, sheet_name, headers, rows, formats)
+                    continue
+                # Try to create a DataFrame from the list
                 try:
                     df = pd.DataFrame(value)
-                except Exception:
-                    # If list items are not dictionaries or inconsistent,
+                except (TypeError, ValueError):
+                    # If list items are inconsistent,
                     # represent as a single column DataFrame
                     df = pd.DataFrame({key: value})
             elif isinstance(value, dict):
-                 # Convert dictionary to DataFrame (e.g., for metadata if it's a dict)
-                 df = pd.DataFrame.from_dict(value, orient='index', columns=[key])
+                # Write dictionaries (e.g., metadata if it's a dict) as Name/Value rows, like pbixray's metadata table
+                if value:
+                    write_records(writer, sheet_name, ["Name", "Value"], value.items(), formats)
+                continue
             else:
                 # Handle other types, perhaps as a single value DataFrame
                 df = pd.DataFrame({key: [value]})
 
-            # Write the DataFrame to a sheet named after the key
+            # Write the DataFrame to a sheet named after the key, row by row via xlsxwriter
             if not df.empty:
-                # Ensure sheet name is valid (max 31 chars, no invalid characters)
-                sheet_name = key[:31]
-                sheet_name = "".join([c for c in sheet_name if c.isalnum() or c in (' ', '_')]).rstrip()
-                if not sheet_name:
-                    sheet_name = "Sheet" + str(list(report_data.keys()).index(key) + 1) # Fallback name
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
-
-    output.seek(0)
-    return output
-
+                write_records(writer, sheet_name, df.columns.tolist(), df.itertuples(index=False, name=None), formats)
 
-def main():
-    st.title("Power BI Report Documentation Generator")
-
-    uploaded_file = st.file_uploader("Upload your Power BI .pbix file", type="pbix")
+    return output.getvalue()
 
-    if uploaded_file is not None:
-        try:
-            # Create a temporary file to save the uploaded pbix
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pbix") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
-                tmp_pbix_path = tmp_file.name
 
-            st.success(f"File uploaded successfully: {uploaded_file.name}")
+# Build the Excel workbook once per uploaded file; reruns are served from the cache
+@st.cache_data(show_spinner=False, max_entries=8)
+def build_excel_doc(file_hash: str, _report_data: dict) -> bytes:
+    """Returns the Excel documentation bytes for the report data of the given file."""
+    return generate_excel_doc(_report_data)
 
-            st.subheader("Extracting Report Information:")
 
-            # Initialize PBIXRay with the temporary file path
-            pbix_ray = PBIXRay(tmp_pbix_path)
+# Rendered as a fragment so interacting with the downloads only reruns this block
+@st.fragment
+def render_downloads(file_hash, report_data, file_name):
+    """Renders the download buttons for the generated documentation."""
+    st.subheader("Download Documentation:")
 
-            # Extract various pieces of information using pbixray
-            metadata = pbix_ray.metadata
-            st.write("Metadata:", metadata)
+    base_name = os.path.splitext(file_name)[0]
 
-            #model = pbix_ray.model
+    # Add download button for Excel; the workbook is only built when the button is clicked
+    st.download_button(
+        label="Download as Excel (.xlsx)",
+        data=lambda: build_excel_doc(file_hash, report_data),
+        file_name=f"{base_name}_documentation.xlsx",
+        mime=XLSX_MIME,
+        # Serving the file needs no script run
+        on_click="ignore")
 
-            schema = pbix_ray.schema
-            st.write("Schema:", schema)
 
-            relationships = pbix_ray.relationships
-            st.write("Relationships:", relationships)
+def main():
+    st.title("Power BI Report Documentation Generator")
 
-            power_query = pbix_ray.power_query
-            st.write("Power Query:", power_query)
+    st.sidebar.checkbox("Show extracted report data", key="debug")
 
-            m_parameters = pbix_ray.m_parameters
-            st.write("M Parameters:", m_parameters)
+    uploaded_file = st.file_uploader("Upload your Power BI .pbix file", type="pbix")
 
-            dax_tables = pbix_ray.dax_tables
-            st.write("DAX Tables:", dax_tables)
+    if uploaded_file is not None:
+        try:
+            # Fingerprint the upload once; every cached helper is keyed on this instead of the raw bytes
+            file_hash = fingerprint_upload(uploaded_file)
 
-            dax_measures = pbix_ray.dax_measures
-            st.write("DAX Measures:", dax_measures)
+            st.success(f"File uploaded successfully: {uploaded_file.name}")
 
+            report_data = load_pbix(file_hash, uploaded_file)
 
             st.success("Information extracted successfully!")
 
-            # Store extracted information in a dictionary for later use
-            report_data = {
-                "metadata": metadata,
-                "schema": schema,
-                "relationships": relationships,
-                "power_query": power_query,
-                "m_parameters": m_parameters,
-                "dax_tables": dax_tables,
-                "dax_measures": dax_measures,
-                #"model": model,
-            }
-
-            # Print types and column names for debugging
-            print("\n--- Debugging report_data types and columns ---")
-            for key, value in report_data.items():
-                print(f"Key: {key}, Type: {type(value)}")
-                if isinstance(value, pd.DataFrame):
-                    print(f"  DataFrame empty: {value.empty}")
-                    if not value.empty:
-                         print(f"  DataFrame columns: {value.columns.tolist()}")
-                         # print(f"  DataFrame head:\n{value.head()}") # Uncomment for more detailed inspection if needed
-                elif isinstance(value, list):
-                     print(f"  List length: {len(value)}")
-                     if value:
-                          print(f"  First item type: {type(value[0])}")
-                          # print(f"  First item:\n{value[0]}") # Uncomment for more detailed inspection if needed
-                else:
-                    print(f"  Value: {value}")
-            print("---------------------------------------------")
-
-
-            # Clean up the temporary file
-            os.remove(tmp_pbix_path)
-
-            st.subheader("Download Documentation:")
-
-            # Add download button for Excel
-            excel_doc_stream = generate_excel_doc(report_data)
-            st.download_button(
-                label="Download as Excel (.xlsx)",
-                data=excel_doc_stream,
-                file_name=f"{os.path.splitext(uploaded_file.name)[0]}_documentation.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            # Rendering every table is costly on large reports, so it only happens when
+            # requested from the sidebar
+            if st.session_state.get("debug"):
+                st.subheader("Extracted Report Information:")
+
+                arrow_tables = get_arrow_tables(file_hash, report_data)
+                st.write("Metadata:", arrow_tables["metadata"])
+                st.write("Schema:", arrow_tables["schema"])
+                st.write("Relationships:", arrow_tables["relationships"])
+                st.write("Power Query:", arrow_tables["power_query"])
+                st.write("M Parameters:", arrow_tables["m_parameters"])
+                st.write("DAX Tables:", arrow_tables["dax_tables"])
+                st.write("DAX Measures:", arrow_tables["dax_measures"])
+
+            # Log types and column names for debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                for key, value in report_data.items():
+                    logger.debug("Key: %s, Type: %s", key, type(value))
+                    if isinstance(value, pd.DataFrame):
+                        logger.debug("  DataFrame empty: %s", value.empty)
+                        if not value.empty:
+                            logger.debug("  DataFrame columns: %s", value.columns.tolist())
+                    elif isinstance(value, list):
+                        logger.debug("  List length: %s", len(value))
+                        if value:
+                            logger.debug("  First item type: %s", type(value[0]))
+                    else:
+                        logger.debug("  Value: %s", value)
+
+            render_downloads(file_hash, report_data, uploaded_file.name)
 
             #st.subheader("Show data from Tables:")
                 
@@ -152,9 +270,6 @@ def main():
         except Exception as e:
             st.error(f"An error occurred: {e}")
             st.error(traceback.format_exc()) # Print the full traceback
-            # Ensure temporary file is removed even if an error occurs
-            if 'tmp_pbix_path' in locals() and os.path.exists(tmp_pbix_path):
-                os.remove(tmp_pbix_path)
 
 
 if __name__ == "__main__":